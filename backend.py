@@ -28,7 +28,7 @@ from database import (
 )
 
 # Import Pritam's system prompt
-from prompts import get_system_prompt
+from prompts import SYSTEM_MESSAGES, get_phase
 
 # ============================================
 # Initialize FastAPI App
@@ -106,11 +106,11 @@ def chat(request: ChatRequest):
     # Get conversation history from database
     history = get_conversation_history(request.session_id)
     
-    # Get Pritam's system prompt
-    system_prompt = get_system_prompt()
+    # Pritam's system message for the phase of this message
+    prompt_number = sum(1 for msg in history if msg["role"] == "user") + 1
     
     # Build messages for Groq API
-    groq_messages = [{"role": "system", "content": system_prompt}]
+    groq_messages = [SYSTEM_MESSAGES[get_phase(prompt_number)]]
     
     # Add conversation history
     for msg in history:
@@ -6,10 +6,16 @@ Supports both email and name inputs
 
 from typing import Optional, List, Dict
 from pydantic import BaseModel
-from fastapi import FastAPI, HTTPException
-from datetime import datetime
+from fastapi import FastAPI, HTTPException, BackgroundTasks
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from starlette.middleware.gzip import GZipMiddleware
+from datetime import datetime, timezone
+import asyncio
 import os
+import orjson
 import google.generativeai as genai
+import redis.asyncio as redis
+from cachetools import LRUCache
 from dotenv import load_dotenv
 
 # Load environment variables
@@ -19,26 +25,154 @@ load_dotenv()
 from database import (
     get_or_create_student,
     create_session,
-    save_message,
-    get_conversation_history,
     get_user_sessions,
-    session_exists,
-    get_session_name,
-    test_connection
+    aget_session_with_history,
+    asave_messages,
+    asave_session_summary,
+    has_summary_columns,
+    init_async_pool,
+    close_async_pool,
+    test_connection,
+    to_ist
 )
 
 # Import Pritam's system prompt
-from prompts import get_system_prompt
+from prompts import SYSTEM_PROMPTS, get_phase, validate_opening_cue, SUMMARY_SYSTEM_PROMPT
 
 # ============================================
 # Initialize FastAPI App
 # ============================================
-app = FastAPI(title="AI Therapy Chatbot API (Gemini)", version="3.0.0")
+app = FastAPI(
+    title="AI Therapy Chatbot API (Gemini)",
+    version="3.0.0",
+    default_response_class=ORJSONResponse  # orjson for all JSON responses
+)
+
+class ChatGZipMiddleware(GZipMiddleware):
+    """GZip responses, except the /chat/stream event stream (gzip would hold events back)"""
+    
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] == "http" and scope["path"] == "/chat/stream":
+            await self.app(scope, receive, send)
+            return
+        await super().__call__(scope, receive, send)
+
+# Compress larger responses (e.g. long conversations) on the wire
+app.add_middleware(ChatGZipMiddleware, minimum_size=1024, compresslevel=5)
 
 # ============================================
 # Initialize Gemini Client
 # ============================================
-genai.configure(api_key=os.environ.get("GEMINI_API_KEY"))
+
+# All Gemini calls here are async (generate_content_async), so use the asyncio
+# gRPC transport: one HTTP/2 channel per worker, multiplexing concurrent calls.
+# (transport="grpc" would put the async client on the blocking gRPC stub)
+GEMINI_TRANSPORT = "grpc_asyncio"
+
+genai.configure(api_key=os.environ.get("GEMINI_API_KEY"), transport=GEMINI_TRANSPORT)
+
+# Pritam's system prompt only changes with his phase, so build one model
+# per phase once and reuse them
+MODELS = {
+    phase: genai.GenerativeModel(
+        'gemini-2.0-flash',
+        system_instruction=system_prompt
+    )
+    for phase, system_prompt in SYSTEM_PROMPTS.items()
+}
+
+# Cheaper model that keeps a running summary of older messages
+SUMMARY_MODEL = genai.GenerativeModel(
+    'gemini-2.0-flash-lite',
+    system_instruction=SUMMARY_SYSTEM_PROMPT
+)
+
+# Gemini gets the summary plus every message after it. Once more than
+# HISTORY_WINDOW + 2 * SUMMARY_EVERY_TURNS messages are unsummarised, the
+# summary is extended (in the background) up to the last HISTORY_WINDOW
+HISTORY_WINDOW = 20  # messages, i.e. the last 10 exchanges
+SUMMARY_EVERY_TURNS = 10
+
+# ============================================
+# Conversation Cache
+# ============================================
+
+# session_id -> {"owner": email, "messages": [...], "gemini_history": [...], "summary": ...}
+# "owner" is the email the session was verified against, checked on every hit;
+# "messages" has the same shape as get_conversation_history; "gemini_history"
+# is the same conversation already in Gemini format, so each turn only
+# appends to it instead of re-reading and re-converting the whole history;
+# "summary" is the session's running summary (see aget_session_with_history)
+HISTORY = LRUCache(maxsize=1024)
+
+# Optional Redis cache shared by all workers/replicas. When REDIS_URL is set,
+# Redis is the source of truth (an in-process copy could miss turns handled
+# by another worker) and stores {"owner", "messages"} as JSON under
+# hist:{session_id} and the summary under summary:{session_id}
+REDIS_URL = os.environ.get("REDIS_URL")
+redis_client = redis.Redis.from_url(REDIS_URL) if REDIS_URL else None
+REDIS_HISTORY_TTL = 3600  # seconds
+
+def redis_history_key(session_id: str) -> str:
+    return f"hist:{session_id}"
+
+def redis_summary_key(session_id: str) -> str:
+    return f"summary:{session_id}"
+
+# Number of server worker processes, from WEB_CONCURRENCY: uvicorn's --workers
+# and gunicorn's -w both default to it, so set WEB_CONCURRENCY (not those flags)
+# to run several workers and the server and this module agree on the count
+WORKERS = int(os.environ.get("WEB_CONCURRENCY", "1"))
+
+# The in-process cache is only safe with a single worker: with several,
+# each worker's copy would miss turns handled by the others. Multi-worker
+# deployments should set REDIS_URL; without it every turn reads the database
+LOCAL_CACHE_ENABLED = redis_client is None and WORKERS == 1
+
+async def persist_turn(session_id: str, user_message: str, ai_response: str) -> None:
+    """
+    Save one user/assistant exchange in order
+    Runs as a background task after the response has been sent
+    """
+    try:
+        await asave_messages(session_id, [("user", user_message), ("assistant", ai_response)])
+    except Exception as e:
+        print(f"❌ Failed to save messages for session {session_id}: {e}")
+
+# Sessions whose summary is being updated by this worker
+_summaries_in_progress = set()
+
+async def update_summary(session_id: str, entry: Dict) -> None:
+    """
+    Extend the session summary to cover everything except the last
+    HISTORY_WINDOW messages
+    Runs as a background task after the response has been sent
+    """
+    if session_id in _summaries_in_progress:
+        return
+    _summaries_in_progress.add(session_id)
+    
+    try:
+        previous = entry["summary"]
+        start = previous["message_count"] if previous else 0
+        end = len(entry["messages"]) - HISTORY_WINDOW
+        
+        transcript = "\n".join(
+            f"{'Therapist' if msg['role'] == 'user' else 'Pritam'}: {msg['content']}"
+            for msg in entry["messages"][start:end]
+        )
+        response = await SUMMARY_MODEL.generate_content_async(
+            f"Summary so far:\n{previous['text'] if previous else '(none yet)'}\n\n"
+            f"Next part of the conversation:\n{transcript}"
+        )
+        
+        entry["summary"] = {"text": response.text.strip(), "message_count": end}
+        await asave_session_summary(session_id, entry["summary"]["text"], end)
+        await store_cached_summary(session_id, entry)
+    except Exception as e:
+        print(f"❌ Failed to update summary for session {session_id}: {e}")
+    finally:
+        _summaries_in_progress.discard(session_id)
 
 # ============================================
 # Pydantic Models
@@ -52,7 +186,7 @@ class ChatRequest(BaseModel):
 class ChatResponse(BaseModel):
     session_id: str
     ai_response: str
-    timestamp: str
+    timestamp: datetime
 
 class NewSessionRequest(BaseModel):
     user_id: str  # Email
@@ -106,6 +240,186 @@ def convert_to_gemini_format(history: List[Dict]) -> List[Dict]:
     
     return gemini_messages
 
+def build_cache_entry(owner: str, messages: List[Dict], summary: Optional[Dict] = None) -> Dict:
+    """Create a conversation cache entry from database messages"""
+    return {
+        "owner": owner,
+        "messages": messages,
+        "gemini_history": convert_to_gemini_format(messages),
+        "summary": summary
+    }
+
+def count_prompts(entry: Dict) -> int:
+    """Count the therapist messages in a cache entry"""
+    return sum(1 for msg in entry["messages"] if msg["role"] == "user")
+
+def get_model(entry: Dict) -> genai.GenerativeModel:
+    """Get the model with Pritam's prompt for the phase of the next message"""
+    return MODELS[get_phase(count_prompts(entry) + 1)]
+
+def build_gemini_contents(entry: Dict, user_message: str) -> List[Dict]:
+    """
+    Build the contents sent to Gemini for the next user message
+    
+    Messages already covered by the session summary are replaced by one
+    context exchange carrying the summary and the number of therapist
+    prompts so far (Pritam's phase depends on it)
+    
+    Returns:
+        A new list (the cache entry is untouched if Gemini fails)
+    """
+    user_turn = {"role": "user", "parts": [{"text": user_message}]}
+    summary = entry["summary"]
+    
+    if not summary:
+        return entry["gemini_history"] + [user_turn]
+    
+    context = (
+        f"[Session context, not said by the therapist: the therapist has sent "
+        f"{count_prompts(entry)} prompts so far. Summary of the earlier conversation: {summary['text']}]"
+    )
+    
+    return [
+        {"role": "user", "parts": [{"text": context}]},
+        {"role": "model", "parts": [{"text": "(He nods) Okay."}]},
+        *entry["gemini_history"][summary["message_count"]:],
+        user_turn
+    ]
+
+def needs_summary_update(entry: Dict) -> bool:
+    """Check whether enough messages have piled up after the summary to extend it"""
+    summarized = entry["summary"]["message_count"] if entry["summary"] else 0
+    return len(entry["messages"]) - summarized > HISTORY_WINDOW + 2 * SUMMARY_EVERY_TURNS
+
+def record_turn(entry: Dict, user_message: str, ai_response: str) -> None:
+    """Append one user/assistant exchange to a conversation cache entry"""
+    timestamp = to_ist(datetime.now(timezone.utc))
+    entry["messages"].append({"role": "user", "content": user_message, "timestamp": timestamp})
+    entry["messages"].append({"role": "assistant", "content": ai_response, "timestamp": timestamp})
+    entry["gemini_history"].append({"role": "user", "parts": [{"text": user_message}]})
+    entry["gemini_history"].append({"role": "model", "parts": [{"text": ai_response}]})
+
+async def get_cache_entry(session_id: str, user_id: str) -> Dict:
+    """
+    Get a session's conversation cache entry, loading it from the database
+    on a cache miss (a cached entry is only returned to the session's owner)
+    
+    Raises:
+        HTTPException 404 if the session doesn't exist for this user
+    """
+    if redis_client is not None:
+        try:
+            cached, summary = await redis_client.mget(
+                redis_history_key(session_id),
+                redis_summary_key(session_id)
+            )
+            if cached is not None:
+                cached = orjson.loads(cached)
+                if cached["owner"] != user_id:
+                    raise HTTPException(status_code=404, detail="Session not found")
+                return build_cache_entry(
+                    cached["owner"],
+                    cached["messages"],
+                    orjson.loads(summary) if summary is not None else None
+                )
+        except redis.RedisError as e:
+            print(f"❌ Redis read failed, falling back to database: {e}")
+    elif LOCAL_CACHE_ENABLED:
+        entry = HISTORY.get(session_id)
+        if entry is not None:
+            if entry["owner"] != user_id:
+                raise HTTPException(status_code=404, detail="Session not found")
+            return entry
+    
+    # Validate session and load its messages in one round-trip
+    session = await aget_session_with_history(session_id, user_id)
+    
+    if session is None:
+        raise HTTPException(status_code=404, detail="Session not found")
+    
+    entry = build_cache_entry(user_id, session["messages"], session["summary"])
+    await store_cache_entry(session_id, entry)
+    if entry["summary"]:
+        await store_cached_summary(session_id, entry)
+    
+    return entry
+
+async def store_cache_entry(session_id: str, entry: Dict) -> None:
+    """Save a session's conversation cache entry (Redis if configured, else in-process if enabled)"""
+    if redis_client is not None:
+        try:
+            # The summary is written separately (store_cached_summary) so an
+            # older copy can't overwrite it; just keep it alive as long as the history
+            async with redis_client.pipeline(transaction=False) as pipe:
+                pipe.set(
+                    redis_history_key(session_id),
+                    orjson.dumps({"owner": entry["owner"], "messages": entry["messages"]}),
+                    ex=REDIS_HISTORY_TTL
+                )
+                pipe.expire(redis_summary_key(session_id), REDIS_HISTORY_TTL)
+                await pipe.execute()
+        except redis.RedisError as e:
+            print(f"❌ Redis write failed: {e}")
+    elif LOCAL_CACHE_ENABLED:
+        HISTORY[session_id] = entry
+
+async def store_cached_summary(session_id: str, entry: Dict) -> None:
+    """Save a cache entry's summary to Redis (the in-process entry already holds it)"""
+    if redis_client is not None:
+        try:
+            await redis_client.set(
+                redis_summary_key(session_id),
+                orjson.dumps(entry["summary"]),
+                ex=REDIS_HISTORY_TTL
+            )
+        except redis.RedisError as e:
+            print(f"❌ Redis write failed: {e}")
+
+async def evict_cache_entry(session_id: str) -> None:
+    """Drop a session's conversation cache entry"""
+    HISTORY.pop(session_id, None)
+    if redis_client is not None:
+        try:
+            await redis_client.delete(
+                redis_history_key(session_id),
+                redis_summary_key(session_id)
+            )
+        except redis.RedisError as e:
+            print(f"❌ Redis delete failed: {e}")
+
+async def finish_turn(
+    entry: Dict,
+    request: ChatRequest,
+    ai_response: str,
+    background_tasks: BackgroundTasks
+) -> None:
+    """
+    Record a completed reply: update the cached history right away (so the
+    next turn sees it) and schedule the database save and summary update
+    to run after the response is sent
+    """
+    if not validate_opening_cue(ai_response):
+        print(f"⚠️ Reply without an opening (Action) cue in session {request.session_id}")
+    
+    record_turn(entry, request.message, ai_response)
+    await store_cache_entry(request.session_id, entry)
+    
+    background_tasks.add_task(persist_turn, request.session_id, request.message, ai_response)
+    if needs_summary_update(entry):
+        background_tasks.add_task(update_summary, request.session_id, entry)
+
+def format_sse(event: str, data: Dict) -> str:
+    """Format one Server-Sent Event with a JSON payload"""
+    return f"event: {event}\ndata: {orjson.dumps(data).decode()}\n\n"
+
+def log_gemini_error() -> None:
+    import traceback
+    error_details = traceback.format_exc()
+    print("=" * 50)
+    print("🔴 GEMINI API ERROR:")
+    print(error_details)
+    print("=" * 50)
+
 # ============================================
 # API Endpoints
 # ============================================
@@ -122,142 +436,159 @@ def root():
     }
 
 @app.post("/chat", response_model=ChatResponse)
-def chat(request: ChatRequest):
+async def chat(request: ChatRequest, background_tasks: BackgroundTasks):
     """
     Main chat endpoint - Send message and get AI response
     Now uses Gemini 2.0 Flash instead of Groq
+    Runs on the event loop: Gemini and the asyncpg pool are awaited
     """
     
-    # Validate session exists
-    if not session_exists(request.session_id):
-        raise HTTPException(status_code=404, detail="Session not found")
-    
-    # Get conversation history from database
-    history = get_conversation_history(request.session_id)
-    
-    # Get Pritam's system prompt
-    system_prompt = get_system_prompt()
-    
-    # Initialize Gemini model with system instruction
-    model = genai.GenerativeModel(
-        'gemini-2.0-flash',
-        system_instruction=system_prompt
-    )
-    
-    # Convert history to Gemini format
-    gemini_messages = convert_to_gemini_format(history)
+    # Get conversation history, only hitting the database on a cache miss
+    entry = await get_cache_entry(request.session_id, request.user_id)
     
-    # Add current user message
-    gemini_messages.append({
-        "role": "user",
-        "parts": [{"text": request.message}]
-    })
+    # Summary + recent Gemini-format history + current user message
+    gemini_messages = build_gemini_contents(entry, request.message)
+    model = get_model(entry)
     
     # Call Gemini API
     try:
-        # Start a chat with history
-        chat = model.start_chat(history=gemini_messages[:-1])  # All except last message
-        
-        # Send the current message
-        response = chat.send_message(gemini_messages[-1]["parts"][0]["text"])
+        # Send the full conversation (history + current message) in one call
+        response = await model.generate_content_async(gemini_messages)
         
         ai_response = response.text
         
     except Exception as e:
-        import traceback
-        error_details = traceback.format_exc()
-        print("=" * 50)
-        print("🔴 GEMINI API ERROR:")
-        print(error_details)
-        print("=" * 50)
+        log_gemini_error()
         raise HTTPException(status_code=500, detail=f"Gemini API error: {str(e)}")
 
-    # Save both messages to database
-    save_message(request.session_id, "user", request.message)
-    save_message(request.session_id, "assistant", ai_response)
+    await finish_turn(entry, request, ai_response, background_tasks)
+    
+    # Return response (validated once against response_model)
+    return {
+        "session_id": request.session_id,
+        "ai_response": ai_response,
+        "timestamp": datetime.now()
+    }
+
+@app.post("/chat/stream")
+async def chat_stream(request: ChatRequest, background_tasks: BackgroundTasks):
+    """
+    Streaming chat endpoint - Same as /chat, but sends the AI response as
+    Server-Sent Events while Gemini is still generating it
+    
+    Events:
+        message: {"text": <next chunk of the response>}
+        done:    {"session_id": ..., "timestamp": ...}
+        error:   {"detail": ...}
+    """
+    
+    # Get conversation history (404s here, before the stream starts)
+    entry = await get_cache_entry(request.session_id, request.user_id)
     
-    # Return response
-    return ChatResponse(
-        session_id=request.session_id,
-        ai_response=ai_response,
-        timestamp=datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    gemini_messages = build_gemini_contents(entry, request.message)
+    model = get_model(entry)
+    
+    async def event_stream():
+        chunks = []
+        
+        try:
+            response = await model.generate_content_async(gemini_messages, stream=True)
+            
+            async for chunk in response:
+                chunks.append(chunk.text)
+                yield format_sse("message", {"text": chunk.text})
+        
+        except Exception as e:
+            log_gemini_error()
+            yield format_sse("error", {"detail": f"Gemini API error: {str(e)}"})
+            return
+        
+        # Only a complete reply is cached and saved
+        ai_response = "".join(chunks)
+        # Background tasks run once the stream has finished
+        await finish_turn(entry, request, ai_response, background_tasks)
+        
+        yield format_sse("done", {
+            "session_id": request.session_id,
+            "timestamp": datetime.now()
+        })
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        background=background_tasks
     )
 
 @app.post("/sessions/new", response_model=NewSessionResponse)
-def create_new_session(request: NewSessionRequest):
+async def create_new_session(request: NewSessionRequest):
     """
     Create a new chat session for a user
     Accepts both email and name
     """
     
     # Get or create student with provided email and name
-    student_id = get_or_create_student(
+    student_id = await asyncio.to_thread(
+        get_or_create_student,
         email=request.user_id,
         name=request.name
     )
     
     # Create new session
-    session_id, session_name = create_session(student_id, "Pritam")
+    session_id, session_name = await asyncio.to_thread(create_session, student_id, "Pritam")
     
-    return NewSessionResponse(
-        session_id=session_id,
-        session_name=session_name
-    )
+    return {
+        "session_id": session_id,
+        "session_name": session_name
+    }
+
+@app.post("/sessions/{session_id}/close")
+async def close_session(session_id: str):
+    """
+    Drop a session's cached history (called when the user logs out)
+    """
+    
+    await evict_cache_entry(session_id)
+    
+    return {"session_id": session_id, "status": "closed"}
 
 @app.get("/users/{user_id}/sessions", response_model=List[SessionInfo])
-def get_sessions_for_user(user_id: str):
+async def get_sessions_for_user(user_id: str):
     """
     Get all sessions for a user
     Retrieves from Supabase database
     """
     
-    sessions = get_user_sessions(user_id)
-    
-    return [
-        SessionInfo(
-            session_id=s["session_id"],
-            session_name=s["session_name"],
-            created_at=s["created_at"],
-            message_count=s["message_count"]
-        )
-        for s in sessions
-    ]
+    # Already in SessionInfo shape - response_model validates it once
+    return await asyncio.to_thread(get_user_sessions, user_id)
 
 @app.get("/conversations/{session_id}", response_model=ConversationResponse)
-def get_conversation(session_id: str, user_id: str):
+async def get_conversation(session_id: str, user_id: str):
     """
     Get full conversation for a specific session
     Retrieves from Supabase database
     """
     
-    # Validate session exists
-    if not session_exists(session_id):
-        raise HTTPException(status_code=404, detail="Session not found")
-    
-    # Get session name
-    session_name = get_session_name(session_id, user_id)
+    # Validate session and get its name and messages in one round-trip
+    session = await aget_session_with_history(session_id, user_id)
     
-    if not session_name:
+    if session is None:
         raise HTTPException(status_code=404, detail="Session not found for this user")
     
-    # Get messages
-    messages = get_conversation_history(session_id)
-    
-    # Convert to response model
+    # Convert to response shape (validated once against response_model)
     message_list = [
-        Message(
-            role="student" if msg["role"] == "user" else "ai",
-            content=msg["content"],
-            timestamp=msg["timestamp"]
-        )
-        for msg in messages
+        {
+            "role": "student" if msg["role"] == "user" else "ai",
+            "content": msg["content"],
+            "timestamp": msg["timestamp"]
+        }
+        for msg in session["messages"]
     ]
     
-    return ConversationResponse(
-        session_id=session_id,
-        session_name=session_name,
-        messages=message_list
-    )
+    return {
+        "session_id": session_id,
+        "session_name": session["session_name"],
+        "messages": message_list
+    }
 
 # ============================================
 # Startup Event
@@ -269,21 +600,47 @@ async def startup_event():
     print("=" * 50)
     print("🚀 Starting AI Therapy Chatbot API (Gemini)")
     print("=" * 50)
-    test_connection()
+    # Every session query reads the summary columns, so refuse to start
+    # without them rather than failing each chat request
+    if test_connection() and not has_summary_columns():
+        raise RuntimeError(
+            "sessions.summary columns are missing - run migrations/001_session_summary.sql"
+        )
+    
+    try:
+        await init_async_pool()
+        print("✅ Async database pool created!")
+    except Exception as e:
+        print(f"❌ Async database pool creation failed: {e}")
     
     # Test Gemini API connection
     try:
-        genai.configure(api_key=os.environ.get("GEMINI_API_KEY"))
+        genai.configure(api_key=os.environ.get("GEMINI_API_KEY"), transport=GEMINI_TRANSPORT)
         print("✅ Gemini API configured successfully!")
     except Exception as e:
         print(f"❌ Gemini API configuration failed: {e}")
     
     print("=" * 50)
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Close the database pool on shutdown"""
+    await close_async_pool()
+
 # ============================================
 # Run Server
 # ============================================
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    # uvloop event loop + httptools parser (installed via uvicorn[standard]),
+    # WEB_CONCURRENCY processes (1 unless set) - each gets its own Gemini client and database pool
+    # Alternatively: WEB_CONCURRENCY=4 gunicorn -k uvicorn.workers.UvicornWorker backend_gemini:app
+    uvicorn.run(
+        "backend_gemini:app",
+        host="0.0.0.0",
+        port=8000,
+        workers=WORKERS,
+        loop="uvloop",
+        http="httptools"
+    )
@@ -1,13 +1,16 @@
 """
 Database connection and helper functions for Supabase
 Updated: Added IST timezone conversion for all timestamps
+Updated: Added asyncpg pool and async variants of the chat hot-path queries
 """
 
 import psycopg2
+import asyncpg
 from psycopg2.extras import RealDictCursor
 from contextlib import contextmanager
 import os
-from typing import Optional, List, Dict
+import asyncio
+from typing import Optional, List, Dict, Tuple
 import uuid
 from dotenv import load_dotenv
 from datetime import datetime, timezone, timedelta
@@ -52,8 +55,8 @@ def to_ist(utc_datetime) -> str:
     # Convert to IST
     ist_datetime = utc_datetime.astimezone(IST)
     
-    # Format with date and time
-    return ist_datetime.strftime("%Y-%m-%d %H:%M:%S")
+    # Format with date and time (same output as strftime("%Y-%m-%d %H:%M:%S"), but faster)
+    return ist_datetime.replace(tzinfo=None).isoformat(sep=" ", timespec="seconds")
 
 # ============================================
 # Connection Pool Helper
@@ -326,6 +329,187 @@ def get_session_name(session_id: str, email: str) -> Optional[str]:
         
         return None
 
+def session_from_rows(rows) -> Optional[Dict]:
+    """Build the aget_session_with_history result from its query rows"""
+    if not rows:
+        return None
+    
+    session = rows[0]
+    
+    return {
+        "session_name": f"Session-{session['session_number']}",
+        "summary": {
+            "text": session['summary'],
+            "message_count": session['summary_message_count']
+        } if session['summary'] else None,
+        "messages": [
+            {
+                "role": row['sender_type'],
+                "content": row['content'],
+                "timestamp": to_ist(row['created_at'])  # Convert to IST
+            }
+            for row in rows
+            if row['sender_type'] is not None
+        ]
+    }
+
+# ============================================
+# Async Connection Pool (asyncpg)
+# ============================================
+
+# One pool per process - created on app startup, or on first use if that failed
+async_pool: Optional[asyncpg.Pool] = None
+_async_pool_lock = asyncio.Lock()
+
+async def init_async_pool() -> asyncpg.Pool:
+    """Create the asyncpg connection pool for this process (if not created yet)"""
+    global async_pool
+    async with _async_pool_lock:
+        if async_pool is None:
+            # statement_cache_size=0: Supabase's pooler (PgBouncer, transaction
+            # mode) doesn't support prepared statements being cached per connection
+            async_pool = await asyncpg.create_pool(
+                DATABASE_URL,
+                min_size=1,
+                max_size=10,
+                statement_cache_size=0
+            )
+    return async_pool
+
+async def close_async_pool() -> None:
+    """Close the asyncpg connection pool"""
+    global async_pool
+    if async_pool is not None:
+        await async_pool.close()
+        async_pool = None
+
+async def get_async_pool() -> asyncpg.Pool:
+    """
+    Get the asyncpg connection pool, creating it on first use
+    
+    Each async helper below is a single statement, so it runs straight on the
+    pool (autocommit, one round trip) instead of in a BEGIN/COMMIT transaction
+    
+    Usage:
+        pool = await get_async_pool()
+        rows = await pool.fetch("SELECT * FROM students")
+    """
+    return async_pool or await init_async_pool()
+
+# ============================================
+# Async Database Helper Functions
+# ============================================
+
+async def asave_messages(session_id: str, messages: List[Tuple[str, str]]) -> None:
+    """
+    Save several messages to the database in one INSERT
+    
+    Args:
+        session_id: UUID of the session
+        messages: (sender_type, content) pairs, in conversation order
+    """
+    if not messages:
+        return
+    
+    # Each row gets the session's current max sequence number + its position;
+    # $1 is the session_id, then each row takes two parameters
+    rows = ", ".join(
+        f"($1, ${2 * position}, ${2 * position + 1}, (SELECT last_seq FROM base) + {position}, CURRENT_TIMESTAMP)"
+        for position in range(1, len(messages) + 1)
+    )
+    params = [value for message in messages for value in message]
+    
+    pool = await get_async_pool()
+    await pool.execute(
+        f"""
+        WITH base AS (
+            SELECT COALESCE(MAX(sequence_number), 0) as last_seq
+            FROM messages WHERE session_id = $1
+        )
+        INSERT INTO messages (session_id, sender_type, content, sequence_number, created_at)
+        VALUES {rows}
+        """,
+        session_id, *params
+    )
+
+async def aget_session_with_history(session_id: str, email: str) -> Optional[Dict]:
+    """
+    Get a session's name and all of its messages in a single query
+    
+    Args:
+        session_id: UUID of the session
+        email: Student's email (for verification)
+    
+    Returns:
+        Dict with session_name, summary (text and how many of the first
+        messages it covers, or None) and messages (role, content, timestamp
+        in IST), or None if the session doesn't exist for this user
+    """
+    pool = await get_async_pool()
+    # One row per message; a session without messages still returns one row
+    rows = await pool.fetch(
+        """
+        WITH target AS (
+            SELECT s.session_id, s.summary, s.summary_message_count,
+                   (SELECT COUNT(*) FROM sessions s2
+                    JOIN students st2 ON s2.student_id = st2.student_id
+                    WHERE st2.email = $2 AND s2.created_at <= s.created_at) as session_number
+            FROM sessions s
+            JOIN students st ON s.student_id = st.student_id
+            WHERE s.session_id = $1 AND st.email = $2
+        )
+        SELECT t.session_number, t.summary, t.summary_message_count,
+               m.sender_type, m.content, m.created_at
+        FROM target t
+        LEFT JOIN messages m ON m.session_id = t.session_id
+        ORDER BY m.sequence_number ASC
+        """,
+        session_id, email
+    )
+    
+    return session_from_rows(rows)
+
+async def asave_session_summary(session_id: str, summary: str, message_count: int) -> None:
+    """
+    Save the running summary of a session's older messages
+    
+    Args:
+        session_id: UUID of the session
+        summary: Summary text
+        message_count: How many of the session's first messages it covers
+    """
+    pool = await get_async_pool()
+    await pool.execute(
+        "UPDATE sessions SET summary = $2, summary_message_count = $3 WHERE session_id = $1",
+        session_id, summary, message_count
+    )
+
+# ============================================
+# Schema Check
+# ============================================
+
+def has_summary_columns() -> bool:
+    """
+    Check that migrations/001_session_summary.sql has been applied
+    
+    Returns:
+        True if sessions has the summary and summary_message_count columns
+    """
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        
+        cursor.execute(
+            """
+            SELECT COUNT(*) as found
+            FROM information_schema.columns
+            WHERE table_schema = current_schema()
+              AND table_name = 'sessions'
+              AND column_name IN ('summary', 'summary_message_count')
+            """
+        )
+        
+        return cursor.fetchone()['found'] == 2
+
 # ============================================
 # Test Connection
 # ============================================
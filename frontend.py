@@ -6,6 +6,9 @@ Updated: Added Pritam's opening scene-setting message
 
 import streamlit as st
 import requests
+import functools
+import json
+from requests.adapters import HTTPAdapter
 from typing import List, Dict, Optional
 
 # ============================================
@@ -52,19 +55,38 @@ if "sessions_list" not in st.session_state:
 # API Helper Functions
 # ============================================
 
+# Streamlit re-executes this file on every rerun, so the session is kept in
+# cache_resource to reuse its keep-alive connections across reruns
+@st.cache_resource
+def get_http_session() -> requests.Session:
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=10, pool_maxsize=10)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.request = functools.partial(session.request, timeout=90)
+    return session
+
+http = get_http_session()
+
+# Only a healthy result is cached (exceptions aren't), so a backend that
+# comes back up is seen on the next check rather than up to 30s later
+@st.cache_data(ttl=30)
+def ping_backend() -> bool:
+    response = http.get(f"{API_BASE_URL}/")
+    response.raise_for_status()
+    return True
+
 def check_backend_health() -> bool:
     try:
-        response = requests.get(f"{API_BASE_URL}/", timeout=90)
-        return response.status_code == 200
+        return ping_backend()
     except requests.exceptions.RequestException:
         return False
 
 def create_new_session(email: str, name: str) -> tuple:
     try:
-        response = requests.post(
+        response = http.post(
             f"{API_BASE_URL}/sessions/new",
-            json={"user_id": email, "name": name},
-            timeout=90
+            json={"user_id": email, "name": name}
         )
         if response.status_code == 200:
             data = response.json()
@@ -74,24 +96,48 @@ def create_new_session(email: str, name: str) -> tuple:
     except Exception as e:
         return None, None, f"Error: {str(e)}"
 
-def send_message_to_api(user_id: str, session_id: str, message: str) -> tuple:
+def send_message_to_api(user_id: str, session_id: str, message: str, on_chunk=None) -> tuple:
+    """Stream the AI response, calling on_chunk with the text received so far"""
     try:
-        response = requests.post(
-            f"{API_BASE_URL}/chat",
+        with http.post(
+            f"{API_BASE_URL}/chat/stream",
             json={"user_id": user_id, "session_id": session_id, "message": message},
-            timeout=90
-        )
-        if response.status_code == 200:
-            data = response.json()
-            return data["ai_response"], None
-        else:
-            return None, f"Error: {response.status_code}"
+            stream=True
+        ) as response:
+            if response.status_code != 200:
+                return None, f"Error: {response.status_code}"
+            
+            # Parse Server-Sent Events: "event: <name>" then "data: <json>"
+            ai_response = ""
+            event = "message"
+            done = False
+            for line in response.iter_lines(decode_unicode=True):
+                if not line:
+                    event = "message"
+                elif line.startswith("event: "):
+                    event = line[len("event: "):]
+                elif line.startswith("data: "):
+                    data = json.loads(line[len("data: "):])
+                    if event == "error":
+                        return None, f"Error: {data['detail']}"
+                    if event == "message":
+                        ai_response += data["text"]
+                        if on_chunk:
+                            on_chunk(ai_response)
+                    elif event == "done":
+                        done = True
+            
+            # Without "done" the backend didn't finish (and didn't save) the reply
+            if not done:
+                return None, "Error: response was interrupted, please try again"
+            
+            return ai_response, None
     except Exception as e:
         return None, f"Error: {str(e)}"
 
 def get_user_sessions(user_id: str) -> tuple:
     try:
-        response = requests.get(f"{API_BASE_URL}/users/{user_id}/sessions", timeout=90)
+        response = http.get(f"{API_BASE_URL}/users/{user_id}/sessions")
         if response.status_code == 200:
             return response.json(), None
         else:
@@ -101,10 +147,9 @@ def get_user_sessions(user_id: str) -> tuple:
 
 def get_conversation(user_id: str, session_id: str) -> tuple:
     try:
-        response = requests.get(
+        response = http.get(
             f"{API_BASE_URL}/conversations/{session_id}",
-            params={"user_id": user_id},
-            timeout=90
+            params={"user_id": user_id}
         )
         if response.status_code == 200:
             data = response.json()
@@ -114,6 +159,26 @@ def get_conversation(user_id: str, session_id: str) -> tuple:
     except Exception as e:
         return [], None, f"Error: {str(e)}"
 
+def close_session(session_id: str) -> None:
+    try:
+        http.post(f"{API_BASE_URL}/sessions/{session_id}/close")
+    except requests.exceptions.RequestException:
+        pass
+
+# ============================================
+# Session State Helpers
+# ============================================
+
+def reset_chat_state():
+    # Fresh chat with Pritam's greeting - session is created when user sends first message
+    st.session_state.current_session_id = None
+    st.session_state.current_session_name = None
+    st.session_state.messages = [{
+        "role": "ai",
+        "content": PRITAM_OPENING,
+        "timestamp": ""
+    }]
+
 # ============================================
 # Login Screen
 # ============================================
@@ -148,58 +213,35 @@ def show_login_screen():
                     return
                 
                 # Set user info
+                normalized_email = email.strip().lower()
                 st.session_state.logged_in = True
-                st.session_state.current_user_id = email.strip().lower()
+                st.session_state.current_user_id = normalized_email
                 st.session_state.current_user_name = name.strip()
                 
                 # Smart Resume Logic
                 with st.spinner("Loading your sessions..."):
-                    sessions, error = get_user_sessions(email.strip().lower())
+                    sessions, error = get_user_sessions(normalized_email)
+                
+                # Last session (sorted by created_at DESC) - resume it if it has messages
+                latest_session = sessions[0] if not error and sessions else None
                 
-                if not error and sessions and len(sessions) > 0:
-                    # User has existing sessions
-                    latest_session = sessions[0]  # Already sorted by created_at DESC
+                if latest_session and latest_session["message_count"] > 0:
+                    messages, sess_name, error = get_conversation(
+                        normalized_email,
+                        latest_session["session_id"]
+                    )
                     
-                    if latest_session["message_count"] > 0:
-                        # Last session has messages - load it
-                        messages, sess_name, error = get_conversation(
-                            email.strip().lower(),
-                            latest_session["session_id"]
-                        )
-                        
-                        if not error:
-                            st.session_state.current_session_id = latest_session["session_id"]
-                            st.session_state.current_session_name = sess_name
-                            st.session_state.messages = messages
-                            st.success(f"✅ Welcome back, {name}! Resuming {sess_name}")
-                        else:
-                            # Error loading - start fresh with greeting
-                            st.session_state.current_session_id = None
-                            st.session_state.current_session_name = None
-                            st.session_state.messages = [{
-                                "role": "ai",
-                                "content": PRITAM_OPENING,
-                                "timestamp": ""
-                            }]
+                    if not error:
+                        st.session_state.current_session_id = latest_session["session_id"]
+                        st.session_state.current_session_name = sess_name
+                        st.session_state.messages = messages
+                        st.success(f"✅ Welcome back, {name}! Resuming {sess_name}")
                     else:
-                        # Last session is empty - start fresh with greeting
-                        st.session_state.current_session_id = None
-                        st.session_state.current_session_name = None
-                        st.session_state.messages = [{
-                            "role": "ai",
-                            "content": PRITAM_OPENING,
-                            "timestamp": ""
-                        }]
-                        st.success(f"✅ Welcome, {name}!")
+                        # Error loading - start fresh with greeting
+                        reset_chat_state()
                 else:
-                    # First time user or no sessions - start fresh with greeting
-                    st.session_state.current_session_id = None
-                    st.session_state.current_session_name = None
-                    st.session_state.messages = [{
-                        "role": "ai",
-                        "content": PRITAM_OPENING,
-                        "timestamp": ""
-                    }]
+                    # First time user, no sessions or last session is empty - start fresh with greeting
+                    reset_chat_state()
                     st.success(f"✅ Welcome, {name}!")
                 
                 st.rerun()
@@ -223,14 +265,7 @@ def show_chat_screen():
         
         # New Chat Button
         if st.button("➕ New Chat", use_container_width=True):
-            # Reset to None with Pritam's greeting - session will be created when user sends first message
-            st.session_state.current_session_id = None
-            st.session_state.current_session_name = None
-            st.session_state.messages = [{
-                "role": "ai",
-                "content": PRITAM_OPENING,
-                "timestamp": ""
-            }]
+            reset_chat_state()
             st.success("✅ Started new chat")
             st.rerun()
         
@@ -292,6 +327,8 @@ def show_chat_screen():
         
         # Logout button
         if st.button("🚪 Logout", use_container_width=True):
+            if st.session_state.current_session_id:
+                close_session(st.session_state.current_session_id)
             st.session_state.logged_in = False
             st.session_state.current_user_id = None
             st.session_state.current_user_name = None
@@ -306,7 +343,7 @@ def show_chat_screen():
     # ============================================
     
     st.title("Session with Pritam")
-    st.markdown("*He is a reserved 21 year old student. He does not open up easily and might resist, but if you use micro-skills like Open ended questions, paraphrasing, reflection of feeling and take it slow, he certainly would tell you more. You can start with something like 'hello, how are you' or 'what brings you to therapy? All the best :)'*")
+    st.markdown("*He is a reserved 23 year old student. He does not open up easily and might resist, but if you use micro-skills like Open ended questions, paraphrasing, reflection of feeling and take it slow, he certainly would tell you more. You can start with something like 'hello, how are you' or 'what brings you to therapy? All the best :)'*")
     
     # Display chat messages
     for msg in st.session_state.messages:
@@ -322,7 +359,8 @@ def show_chat_screen():
     
     if user_input:
         # Check if we need to create a session first
-        if st.session_state.current_session_id is None:
+        is_new_session = st.session_state.current_session_id is None
+        if is_new_session:
             # First message - create session now
             with st.spinner("Creating session..."):
                 session_id, session_name, error = create_new_session(
@@ -348,13 +386,16 @@ def show_chat_screen():
         with st.chat_message("user", avatar="👨‍⚕️"):
             st.markdown(user_input)
         
-        # Get AI response
-        with st.spinner("Pritam is typing..."):
-            ai_response, error = send_message_to_api(
-                st.session_state.current_user_id,
-                st.session_state.current_session_id,
-                user_input
-            )
+        # Get AI response, displaying it as it streams in
+        with st.chat_message("assistant", avatar="🧑"):
+            response_placeholder = st.empty()
+            with st.spinner("Pritam is typing..."):
+                ai_response, error = send_message_to_api(
+                    st.session_state.current_user_id,
+                    st.session_state.current_session_id,
+                    user_input,
+                    on_chunk=response_placeholder.markdown
+                )
         
         if error:
             st.error(f"❌ {error}")
@@ -366,11 +407,10 @@ def show_chat_screen():
                 "timestamp": ""
             })
             
-            # Display AI response
-            with st.chat_message("assistant", avatar="🧑"):
-                st.markdown(ai_response)
-            
-            st.rerun()
+            # Both messages are already on screen; only a newly created
+            # session needs a full rerun so it shows up in the sidebar
+            if is_new_session:
+                st.rerun()
 
 # ============================================
 # Main App Logic
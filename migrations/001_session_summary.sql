@@ -0,0 +1,5 @@
+-- Running summary of each session's older messages (see backend_gemini.update_summary)
+-- Run once against the database before deploying the backend that reads these columns
+ALTER TABLE sessions
+    ADD COLUMN IF NOT EXISTS summary TEXT,
+    ADD COLUMN IF NOT EXISTS summary_message_count INTEGER NOT NULL DEFAULT 0;